@@ -1,19 +1,128 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from sqlalchemy import delete
 import time
+import hashlib
+import re
+import json
+import structlog
 
 from ..config import settings
-from ..services.database import get_db, Patient, AISummary
+from ..services.database import get_db, Patient, AISummary, AsyncSessionLocal
 from ..schemas.ai import SummarizeRequest, SummarySavedResponse, SummaryListResponse, SummaryListItem
 from ..services import ai_service
+from .etag import compute_etag, is_not_modified
 
 
 
 
+logger = structlog.get_logger()
+
 router = APIRouter()
 
+# MIMIC de-identification placeholders, e.g. [**2151-7-16**] or [**Hospital1 18**]
+DEID_PATTERN = re.compile(r"\[\*\*(.*?)\*\*\]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Built once and kept byte-identical across requests (also keeps provider-side prompt caches warm)
+SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a helpful, respectful and honest medical assistant. You are a second version of Med42 developed by the AI team at M42. "
+    "Always answer as helpfully as possible, while being safe. "
+    "Your answers should not include any harmful, unethical, racist, sexist, toxic, dangerous, or illegal content. "
+    "Please ensure that your responses are socially unbiased and positive in nature. If a question does not make any sense, or is not factually coherent, explain why instead of answering something not correct. "
+    "If you don’t know the answer to a question, please don’t share false information."
+}
+USER_TEMPLATE = "Summarize this discharge summary concisely:\n\n{}"
+PROMPT_CHARS = 4000
+# Raw characters fetched from the database, preprocessing shrinks them before the PROMPT_CHARS cut
+PROMPT_SOURCE_CHARS = 2 * PROMPT_CHARS
+
+
+def preprocess_discharge(text: str) -> str:
+    """Shrink the discharge text before prompting: unwrap de-identification markers and collapse whitespace/line breaks"""
+    text = DEID_PATTERN.sub(r"\1", text)
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
+
+
+def compute_prompt_hash(messages: list) -> str:
+    """Hash of the prompt sent to the model, used to reuse summaries of identical discharge texts"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for message in messages:
+        hasher.update(message["content"].encode())
+    return hasher.hexdigest()
+
+
+async def fetch_patient_and_summary(db: AsyncSession, hadm_id: int):
+    """Patient prompt data and existing summary (only 1 per patient) in a single roundtrip.
+        Only the head of the discharge text is transferred (text_head), text_len is the full length"""
+    query = (
+        select(
+            Patient.hadm_id,
+            func.substr(Patient.text, 1, PROMPT_SOURCE_CHARS).label("text_head"),
+            func.length(Patient.text).label("text_len"),
+            AISummary
+        )
+        .outerjoin(AISummary, AISummary.hadm_id == Patient.hadm_id)
+        .where(Patient.hadm_id == hadm_id)
+    )
+    result = await db.execute(query)
+    row = result.first()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    return row, row.AISummary
+
+
+def build_messages(discharge_text: str) -> list:
+    """Chat messages sent to the model for a discharge text"""
+    return [SYSTEM_MESSAGE, {"role": "user", "content": USER_TEMPLATE.format(preprocess_discharge(discharge_text)[:PROMPT_CHARS])}]
+
+
+async def fetch_cached_summary(db: AsyncSession, prompt_hash: str):
+    """Summary text of an identical prompt already summarized for another admission (None if there is none)"""
+    cached_query = (
+        select(AISummary.summary_text)
+        .where(AISummary.prompt_hash == prompt_hash)
+        .limit(1)
+    )
+    cached_result = await db.execute(cached_query)
+    return cached_result.scalar_one_or_none()
+
+
+def format_event(data, event: str = None) -> str:
+    """Server-sent event frame, data is JSON encoded so newlines in tokens don't break the framing"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+
+async def persist_summary(hadm_id: int, stream_state: dict, original_length: int, prompt_hash: str):
+    """Save a streamed summary after the response is sent (uses its own session, the request one is closed by then)"""
+    if not stream_state["completed"]:
+        return
+
+    async with AsyncSessionLocal() as session:
+        try:
+            new_summary = AISummary(
+                hadm_id=hadm_id,
+                summary_text="".join(stream_state["chunks"]),
+                original_length=original_length,
+                processing_time=stream_state["processing_time"],
+                prompt_hash=prompt_hash
+            )
+            session.add(new_summary)
+            await session.commit()
+
+            logger.info("AI summary saved", summary_id=new_summary.id, hadm_id=new_summary.hadm_id)
+
+        except Exception as e:
+            await session.rollback()
+            logger.error("Error saving AI summary", error=str(e))
+
 
 @router.post("/summarize", response_model=SummarySavedResponse)
 async def summarize_discharge(request: SummarizeRequest, 
@@ -23,21 +132,10 @@ async def summarize_discharge(request: SummarizeRequest,
     """Summarize endpoint that uses Llama3-Med42 to generate a summary of a patient's hospital stay information.
         Gets the data from Patient.text column (discharge text)"""
     
-    # Patient data
-    query = select(Patient).where(Patient.hadm_id == hadm_id)
-    result = await db.execute(query)
-    patient = result.scalar_one_or_none()
-
-    if not patient:
-        raise HTTPException(status_code=404, detail="Patient not found")
-    
-    # Check it summary already exists or not (only 1 per patient)
-    existing_summary_query = select(AISummary).where(AISummary.hadm_id == request.hadm_id)
-    existing_result = await db.execute(existing_summary_query)
-    existing_summary = existing_result.scalar_one_or_none()
+    patient, existing_summary = await fetch_patient_and_summary(db, hadm_id)
     
     if existing_summary:
-        print(f"Returning existing summary for HADM_ID: {request.hadm_id}")
+        logger.debug("Returning existing summary", hadm_id=hadm_id)
         return SummarySavedResponse(
                 id=existing_summary.id,
                 hadm_id=existing_summary.hadm_id,
@@ -50,33 +148,26 @@ async def summarize_discharge(request: SummarizeRequest,
 
 
     
-    messages = [
-            {
-            "role":"system",
-            "content":"You are a helpful, respectful and honest medical assistant. You are a second version of Med42 developed by the AI team at M42. "
-            "Always answer as helpfully as possible, while being safe. "
-            "Your answers should not include any harmful, unethical, racist, sexist, toxic, dangerous, or illegal content. "
-            "Please ensure that your responses are socially unbiased and positive in nature. If a question does not make any sense, or is not factually coherent, explain why instead of answering something not correct. "
-            "If you don’t know the answer to a question, please don’t share false information."
-            },
-            {"role":"user",
-             "content":f"Summarize this discharge summary concisely:\n\n{patient.text[:4000]}"
-            }
-
-        ]
+    messages = build_messages(patient.text_head or "")
     
     start_time = time.time()
     
-    try:
-        response = client.chat_completion(
-            messages=messages,
-            max_tokens=400,
-            temperature=0.5
-        )
-        summary = response.choices[0].message.content
+    # Identical prompt already summarized for another admission -> reuse it instead of calling the model
+    prompt_hash = compute_prompt_hash(messages)
+    summary = await fetch_cached_summary(db, prompt_hash)
+    message = "Summary reused from an identical discharge text. Model was not called." if summary is not None else None
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+    if summary is None:
+        try:
+            response = client.chat_completion(
+                messages=messages,
+                max_tokens=400,
+                temperature=0.5
+            )
+            summary = response.choices[0].message.content
+
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
     
     processing_time = time.time() - start_time
 
@@ -84,15 +175,17 @@ async def summarize_discharge(request: SummarizeRequest,
         new_summary = AISummary(  
             hadm_id=patient.hadm_id,
             summary_text=summary,  
-            original_length=len(patient.text),
-            processing_time=processing_time
+            original_length=patient.text_len or 0,
+            processing_time=processing_time,
+            prompt_hash=prompt_hash
         )
 
+        # The flush INSERT returns the id and created_at is a Python-side default,
+        # with expire_on_commit=False nothing needs to be reloaded afterwards
         db.add(new_summary)
         await db.commit()
-        await db.refresh(new_summary)
 
-        print(f"AI Summary saved with ID: {new_summary.id}")
+        logger.info("AI summary saved", summary_id=new_summary.id, hadm_id=new_summary.hadm_id)
 
         return SummarySavedResponse(
             id=new_summary.id,
@@ -100,50 +193,108 @@ async def summarize_discharge(request: SummarizeRequest,
             summary=new_summary.summary_text,
             original_length=new_summary.original_length,
             created_at=new_summary.created_at,
-            processing_time=new_summary.processing_time
+            processing_time=new_summary.processing_time,
+            message=message
         )
 
         
     except Exception as e:
         await db.rollback()  # Use await for async rollback
-        print(f"Error saving AI summary: {e}")
+        logger.error("Error saving AI summary", error=str(e))
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+
+@router.post("/summarize/stream")
+async def summarize_discharge_stream(db: AsyncSession = Depends(get_db),
+                                     client = Depends(ai_service.get_client),
+                                     hadm_id: int = Query(..., description="Hospital admission ID to summarize", example=170490),):
+    """Streaming version of /summarize: sends the summary as server-sent events while it is generated.
+        The summary is saved in a background task once the response is complete, so the final done event
+        carries its id only for an existing summary (null for a new one)"""
+    
+    patient, existing_summary = await fetch_patient_and_summary(db, hadm_id)
+
+    if existing_summary:
+        logger.debug("Returning existing summary", hadm_id=hadm_id)
+        events = [format_event(existing_summary.summary_text), format_event({"id": existing_summary.id}, event="done")]
+        await db.close()
+        return StreamingResponse(iter(events), media_type="text/event-stream")
+
+    messages = build_messages(patient.text_head or "")
+    prompt_hash = compute_prompt_hash(messages)
+    cached_summary = await fetch_cached_summary(db, prompt_hash)
+    # get_db only exits after the whole stream is sent: give the connection back now instead of
+    # keeping it idle in transaction during generation (persist_summary opens its own session)
+    await db.close()
+    start_time = time.time()
+    stream_state = {"chunks": [], "completed": False, "processing_time": None}
+
+    # Sync generator: Starlette iterates it in a threadpool, so the blocking client doesn't stall the event loop
+    def event_stream():
+        if cached_summary is not None:
+            stream_state["chunks"].append(cached_summary)
+            yield format_event(cached_summary)
+        else:
+            try:
+                for chunk in client.chat_completion(
+                    messages=messages,
+                    max_tokens=400,
+                    temperature=0.5,
+                    stream=True
+                ):
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        stream_state["chunks"].append(delta)
+                        yield format_event(delta)
+
+            except Exception as e:
+                yield format_event(f"AI service error: {str(e)}", event="error")
+                return
+
+        stream_state["processing_time"] = time.time() - start_time
+        stream_state["completed"] = True
+        yield format_event({"id": None}, event="done")  # Not saved yet
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        background=BackgroundTask(persist_summary, patient.hadm_id, stream_state, patient.text_len or 0, prompt_hash)
+    )
     
 
 @router.get("/summaries", response_model=SummaryListResponse)
 async def list_recent_summaries(
+    request: Request,
+    response: Response,
     limit: int = Query(5, ge=1, le=50, description="Number of summaries to retrieve (1-50)"),
     db: AsyncSession = Depends(get_db)
 ):
     """Get recent AI-generated summaries with user-specified limit"""
     
     try:
-        # Get total count
-        count_result = await db.execute(select(func.count()).select_from(AISummary))
-        total_count = count_result.scalar()
-        
-        # If no summary
-        if total_count == 0:
-            return SummaryListResponse(
-                summaries=[],
-                total_count=0,
-                shown_count=0
-            )
-        
-        # Recent summaries
+        # Recent summaries, total count computed in the same query via a window function
         query = (
-            select(AISummary)
+            select(AISummary, func.count().over().label("total"))
             .where(AISummary.summary_text.isnot(None))
             .order_by(AISummary.created_at.desc())
             .limit(limit)
         )
         
         result = await db.execute(query)
-        summaries = result.scalars().all()
+        rows = result.all()
+        total_count = rows[0].total if rows else 0
         
+        # List only changes on summarize/delete, which changes the shown ids or the total
+        etag = compute_etag(total_count, *(summary.id for summary, _ in rows))
+        # Always revalidate, the list changes on POST/DELETE
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if is_not_modified(request, etag):
+            return Response(status_code=304, headers=cache_headers)
+
+        response.headers.update(cache_headers)
         
         summary_items = []
-        for summary in summaries:
+        for summary, _ in rows:
             summary_items.append(SummaryListItem(
                 id=summary.id,
                 hadm_id=summary.hadm_id,
@@ -160,7 +311,7 @@ async def list_recent_summaries(
         )
         
     except Exception as e:
-        print(f"Error retrieving summaries: {e}")
+        logger.error("Error retrieving summaries", error=str(e))
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
@@ -172,17 +323,14 @@ async def delete_patient_summaries(
     """Delete summary of a specific patient"""
     
     try:
+        # Existence check and delete in one statement
+        delete_stmt = delete(AISummary).where(AISummary.hadm_id == hadm_id).returning(AISummary.id)
+        result = await db.execute(delete_stmt)
+        deleted_ids = result.scalars().all()
         
-        existing_query = select(AISummary).where(AISummary.hadm_id == hadm_id)
-        existing_result = await db.execute(existing_query)
-        existing_summaries = existing_result.scalars().all()
-        
-        if not existing_summaries:
+        if not deleted_ids:
             raise HTTPException(status_code=404, detail=f"No summaries found for patient {hadm_id}")
         
-        
-        delete_stmt = delete(AISummary).where(AISummary.hadm_id == hadm_id)
-        await db.execute(delete_stmt)
         await db.commit()
         
         return {
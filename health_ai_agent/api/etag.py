@@ -0,0 +1,18 @@
+from fastapi import Request
+import hashlib
+
+
+def compute_etag(*parts) -> str:
+    """Quoted ETag built from the given values"""
+    digest = hashlib.blake2b("-".join(str(part) for part in parts).encode(), digest_size=8).hexdigest()
+    return f'"{digest}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Check if the client already has this version (If-None-Match header)"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+
+    client_etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in client_etags or "*" in client_etags
@@ -1,12 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, Path
+from fastapi import APIRouter, Depends, HTTPException, Query, Path, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, delete
+from sqlalchemy.dialects.postgresql import insert
 from typing import Optional
 from datetime import datetime
 
 from ..services.database import get_db, Patient
 from ..schemas.patient import PatientResponse, PatientDetail, PatientListResponse, PatientCreate
 from ..services.database import AISummary
+from .etag import compute_etag, is_not_modified
 
 router = APIRouter()
 
@@ -30,25 +32,14 @@ async def create_patient(
     """Insert a new hospital admission (patient record)"""
     
     try:
-        # Check if HADM_ID already exists
-        existing_query = select(Patient).where(Patient.hadm_id == hadm_id)
-        existing_result = await db.execute(existing_query)
-        existing_patient = existing_result.scalar_one_or_none()
-        
-        if existing_patient:
-            raise HTTPException(
-                status_code=409, 
-                detail=f"Patient with HADM_ID {hadm_id} already exists"
-            )
-
         # Process charttime to avoid timezone conflicts
         processed_charttime = charttime.replace(tzinfo=None) if charttime else None
         
-        # Create new patient record
-        new_patient = Patient(
+        # New patient record
+        new_patient = dict(
             hadm_id=hadm_id,
             subject_id=subject_id,
-            gender=gender,
+            gender=gender.upper(),  # Stored uppercase so the gender filter is a plain index lookup
             age_corrected=age_corrected,
             admission_type=admission_type,
             diagnosis=diagnosis,
@@ -61,9 +52,22 @@ async def create_patient(
             text=text
         )
         
-        db.add(new_patient)
+        # Duplicate check and insert in one race-safe statement: no row returned means HADM_ID already exists
+        insert_stmt = (
+            insert(Patient)
+            .values(**new_patient)
+            .on_conflict_do_nothing(index_elements=[Patient.hadm_id])
+            .returning(Patient.hadm_id)
+        )
+        result = await db.execute(insert_stmt)
+        
+        if result.first() is None:
+            raise HTTPException(
+                status_code=409, 
+                detail=f"Patient with HADM_ID {hadm_id} already exists"
+            )
+        
         await db.commit()
-        await db.refresh(new_patient)
         
         return PatientDetail.model_validate(new_patient)
         
@@ -83,28 +87,26 @@ async def delete_patient_and_summaries(
     """Delete a hospital admission and associated AI summary"""
     
     try:
-        
-        patient_query = select(Patient).where(Patient.hadm_id == hadm_id)
-        patient_result = await db.execute(patient_query)
-        patient = patient_result.scalar_one_or_none()
+        # Summaries are removed by ON DELETE CASCADE; the count subquery runs
+        # against the statement snapshot, so it still sees them
+        summaries_count_subquery = (
+            select(func.count())
+            .where(AISummary.hadm_id == hadm_id)
+            .scalar_subquery()
+        )
+        delete_stmt = (
+            delete(Patient)
+            .where(Patient.hadm_id == hadm_id)
+            .returning(Patient.subject_id, Patient.diagnosis, summaries_count_subquery.label("summaries_count"))
+        )
+        result = await db.execute(delete_stmt)
+        patient = result.first()
         
         if not patient:
             raise HTTPException(status_code=404, detail=f"Patient with HADM_ID {hadm_id} not found")
         
-        # Associated summary before deleting
-        summaries_query = select(AISummary).where(AISummary.hadm_id == hadm_id)
-        summaries_result = await db.execute(summaries_query)
-        summaries = summaries_result.scalars().all()
-        summaries_count = len(summaries)
-        
-        # Delete summary
-        if summaries_count > 0:
-            delete_summaries_stmt = delete(AISummary).where(AISummary.hadm_id == hadm_id)
-            await db.execute(delete_summaries_stmt)
-        
-        # Delete patient record
-        await db.delete(patient)
         await db.commit()
+        summaries_count = patient.summaries_count
         
         return {
             "message": f"Successfully deleted patient {hadm_id}",
@@ -137,51 +139,69 @@ async def list_patients(
     """List patients with optional search and filtering"""
     
     try:
-        # Base query
-        query = select(Patient)
-        count_query = select(func.count()).select_from(Patient)
+        # Base query with only the columns the response needs (plain rows, no ORM objects),
+        # total matching rows computed in the same scan via a window function
+        query = select(
+            Patient.hadm_id,
+            Patient.subject_id,
+            Patient.gender,
+            Patient.age_corrected,
+            Patient.admission_type,
+            Patient.diagnosis,
+            Patient.hospital_expire_flag,
+            Patient.ed_los_hours,
+            Patient.total_los_hours,
+            Patient.charttime,
+            # Preview is cut in SQL so the full discharge text never leaves the database
+            func.coalesce(func.substr(Patient.text, 1, 200), "").label("text_preview"),
+            func.length(Patient.text).label("text_len"),
+            func.count().over().label("total")
+        )
         
         # Search elements
-        if q:
+        if q and len(q) >= 3:
+            # Full-text search on the generated tsvector column for whole words, OR partial-word matches on the diagnosis
+            # (pg_trgm GIN index, needs 3+ characters): the planner combines both index scans with a BitmapOr
+            search_condition = (
+                Patient.search_tsv.bool_op("@@")(func.plainto_tsquery("english", q)) |
+                Patient.diagnosis.ilike(f"%{q}%")
+            )
+            query = query.where(search_condition)
+        elif q:
+            # Too short for full-text search, fall back to substring matching
             search_condition = (
                 Patient.diagnosis.ilike(f"%{q}%") |
                 Patient.admission_type.ilike(f"%{q}%") |
                 Patient.gender.ilike(f"%{q}%")
             )
             query = query.where(search_condition)
-            count_query = count_query.where(search_condition)
         
         # Filters
         if gender:
             query = query.where(Patient.gender == gender.upper())
-            count_query = count_query.where(Patient.gender == gender.upper())
         if admission_type:
             query = query.where(Patient.admission_type.ilike(f"%{admission_type}%"))
-            count_query = count_query.where(Patient.admission_type.ilike(f"%{admission_type}%"))
         if age_min is not None:
             query = query.where(Patient.age_corrected >= age_min)
-            count_query = count_query.where(Patient.age_corrected >= age_min)
         if age_max is not None:
             query = query.where(Patient.age_corrected <= age_max)
-            count_query = count_query.where(Patient.age_corrected <= age_max)
         
         # Limit of patients to be displayed
         query = query.limit(limit)
         
         
         result = await db.execute(query)
-        patients_data = result.scalars().all()
-        
-        total_result = await db.execute(count_query)
-        total = total_result.scalar()
+        rows = result.mappings().all()
+        total = rows[0]["total"] if rows else 0
         
         
-        patients = []
-        for patient in patients_data:
-            text_preview = patient.text[:200] + "..." if patient.text and len(patient.text) > 200 else (patient.text or "")
-            patient_response = PatientResponse.model_validate(patient)
-            patient_response.text_preview = text_preview
-            patients.append(patient_response)
+        patients = [
+            PatientResponse.model_validate({
+                **row,
+                "text_preview": row["text_preview"] + "..." if row["text_len"] and row["text_len"] > 200 else row["text_preview"]
+            })
+            for row in rows
+        ]
         
         return PatientListResponse(
             patients=patients,
@@ -194,7 +214,7 @@ async def list_patients(
 
 
 @router.get("/{hadm_id}", response_model=PatientDetail)
-async def get_patient(hadm_id: int = Path(description="Hospital admission ID", example=170490), db: AsyncSession = Depends(get_db)):
+async def get_patient(request: Request, response: Response, hadm_id: int = Path(description="Hospital admission ID", example=170490), db: AsyncSession = Depends(get_db)):
     
     query = select(Patient).where(Patient.hadm_id==hadm_id)
     result = await db.execute(query)
@@ -203,7 +223,15 @@ async def get_patient(hadm_id: int = Path(description="Hospital admission ID", e
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
         
+    # Hash of the full response, a record deleted and re-created (or reloaded) with other values gets a new tag
+    patient_detail = PatientDetail.model_validate(patient)
+    etag = compute_etag(patient_detail.model_dump_json())
+    cache_headers = {"ETag": etag, "Cache-Control": "private, max-age=60"}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    response.headers.update(cache_headers)
     
-    return PatientDetail.model_validate(patient)
+    return patient_detail
 
 
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from typing import Optional
+from functools import cached_property
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +13,13 @@ class Settings(BaseSettings):
     postgres_password: str
     postgres_host: str
     postgres_port: int
+
+    # Database connection pool
+    db_pool_size: int = 20
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 1800
+    db_echo: bool = False
     
     # Model
     model_name: str = "m42-health/med42-v2-8b"
@@ -25,9 +33,9 @@ class Settings(BaseSettings):
     # Logging
     log_level: str = "INFO"
 
-    @property # Required for development and production (I had previously hardcoded the database url)
+    @cached_property # Required for development and production (I had previously hardcoded the database url)
     def database_url(self) -> str:
-        """Construct database URL from components"""
+        """Construct database URL from components (built once per Settings instance)"""
         return f"postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
     
     class Config:
@@ -37,6 +45,7 @@ class Settings(BaseSettings):
     # Hugging Face
     hf_token: Optional[str] = None
     use_api: bool = True
+    ai_timeout: float = 60.0  # Seconds before a request to the inference endpoint is abandoned
 
 
 settings = Settings()
\ No newline at end of file
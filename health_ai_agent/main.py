@@ -6,23 +6,30 @@ from huggingface_hub import InferenceClient
 from typing import Optional
 from contextlib import asynccontextmanager
 from .services import ai_service
+import logging
+import structlog
 
+# Calls below the configured level return immediately (no formatting, no output)
+structlog.configure(
+    wrapper_class=structlog.make_filtering_bound_logger(logging.getLevelName(settings.log_level.upper()))
+)
+logger = structlog.get_logger()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
    
-    print("Starting Health AI Agent...")
+    logger.info("Starting Health AI Agent")
     success = await ai_service.initialize()
 
     if success:
-        print("AI service initialized successfully")
+        logger.info("AI service initialized successfully")
     else:
-        print("Warning: AI service initialization failed")
+        logger.warning("AI service initialization failed")
     
     yield
     
-    print("Shutting down Health AI Agent...")
+    logger.info("Shutting down Health AI Agent")
 
 app = FastAPI(
     title="Health AI Agent",
@@ -1,16 +1,80 @@
 import asyncio
-from health_ai_agent.services.database import engine, Base
+from health_ai_agent.services.database import engine, Base, Patient, AISummary
 from health_ai_agent.config import settings
-from sqlalchemy import text
+from sqlalchemy import Column, Index, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateColumn, CreateIndex
 from health_ai_agent.services.database import AsyncSessionLocal
     
 async def create_tables():
     """Create all database tables"""
     async with engine.begin() as conn:
+        # Needed by the trigram index on the diagnosis column
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.create_all)
     print('Tables created successfully!')
 
 
+def add_column_ddl(column: Column) -> str:
+    """ALTER TABLE ... ADD COLUMN IF NOT EXISTS compiled from a model column"""
+    return f"ALTER TABLE {column.table.name} ADD COLUMN IF NOT EXISTS {CreateColumn(column).compile(dialect=postgresql.dialect())}"
+
+
+def concurrent_index_ddl(index: Index) -> str:
+    """CREATE INDEX CONCURRENTLY IF NOT EXISTS compiled from a model index"""
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=postgresql.dialect()))
+    return ddl.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+
+
+# create_all only builds indexes together with new tables. These statements bring existing
+# tables up to date; CONCURRENTLY builds the index without blocking writes (it can't run in a transaction).
+# Columns and indexes are compiled from the models, so there is a single definition of each
+SCHEMA_UPDATES = [
+    add_column_ddl(AISummary.__mapper__.columns['prompt_hash']),
+    # Older tables have a NO ACTION foreign key, patient deletes rely on the cascade. Only replaced when it isn't
+    # CASCADE yet, NOT VALID skips the check of existing rows while holding the lock that blocks writes
+    """DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ai_summaries_hadm_id_fkey'
+                   AND conrelid = 'ai_summaries'::regclass AND confdeltype <> 'c') THEN
+            ALTER TABLE ai_summaries DROP CONSTRAINT ai_summaries_hadm_id_fkey,
+                ADD CONSTRAINT ai_summaries_hadm_id_fkey FOREIGN KEY (hadm_id)
+                REFERENCES mimic_discharge_summaries("HADM_ID") ON DELETE CASCADE NOT VALID;
+        END IF;
+    END $$""",
+    # Checks the existing rows without blocking writes, no-op once the constraint is valid
+    'ALTER TABLE ai_summaries VALIDATE CONSTRAINT ai_summaries_hadm_id_fkey',
+    # Rewrites the table once (generated column), the statement is a no-op afterwards
+    add_column_ddl(Patient.__mapper__.columns['search_tsv']),
+]
+# Every model index (Index(...) and index=True), already existing ones are skipped
+CONCURRENT_INDEXES = [
+    concurrent_index_ddl(index)
+    for table in (Patient.__table__, AISummary.__table__)
+    for index in sorted(table.indexes, key=lambda index: index.name)
+]
+
+async def create_indexes():
+    """Add new columns and build missing indexes on existing tables"""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for statement in SCHEMA_UPDATES:
+            await conn.execute(text(statement))
+        
+        # A failed CONCURRENTLY build leaves an INVALID index behind, which IF NOT EXISTS would skip forever
+        result = await conn.execute(text(
+            "SELECT indexrelid::regclass::text FROM pg_index "
+            "WHERE NOT indisvalid AND indrelid IN (CAST(:patients AS regclass), CAST(:summaries AS regclass))"
+        ), {"patients": Patient.__tablename__, "summaries": AISummary.__tablename__})
+        for index_name in result.scalars().all():
+            print(f'Dropping invalid index {index_name}')
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        
+        for statement in CONCURRENT_INDEXES:
+            await conn.execute(text(statement))
+    print('Indexes created successfully!')
+
+
 async def check_tables():
     """Check what tables exist"""
     
@@ -52,10 +116,18 @@ async def check_table_contents():
                 print(f"   Created: {record[5]}")
                 print("\n ")
 
+async def check_database():
+    """Run both checks concurrently"""
+    await asyncio.gather(check_tables(), check_table_contents())
+
+
+async def setup_database():
+    await create_tables()
+    await create_indexes()
+
 
 if __name__ == "__main__":
     print(__name__)
-    #asyncio.run(check_table_contents())
-    asyncio.run(create_tables())
-    #asyncio.run(check_tables())
+    asyncio.run(setup_database())
+    #asyncio.run(check_database())
 
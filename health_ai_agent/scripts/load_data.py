@@ -1,93 +1,268 @@
 import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from health_ai_agent.services.database import AsyncSessionLocal, Patient
+import pyarrow as pa
+import pyarrow.dataset as ds
+from health_ai_agent.services.database import Patient
 from health_ai_agent.config import settings
 from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, create_async_engine
+from sqlalchemy.pool import NullPool
+import numpy as np
 import structlog
 import sys
 
 
 logger = structlog.get_logger()
 
-async def load_parquet_data(parquet_file_path: str, batch_size: int = 1000):
-    """Load MIMIC data from parquet file into PostgreSQL"""
+# Dedicated engine for the load script, the app pool settings don't apply: a couple of sequential connections,
+# no pooling (nothing to keep warm), no pre-ping round trip on checkout and never echo
+bulk_engine = create_async_engine(settings.database_url, poolclass=NullPool, echo=False)
+
+# Parquet column -> Patient attribute
+PATIENT_COLUMNS = {
+    'SUBJECT_ID': 'subject_id',
+    'GENDER': 'gender',
+    'HADM_ID': 'hadm_id',
+    'ADMISSION_TYPE': 'admission_type',
+    'DIAGNOSIS': 'diagnosis',
+    'HOSPITAL_EXPIRE_FLAG': 'hospital_expire_flag',
+    'age_corrected': 'age_corrected',
+    'ed_los_hours': 'ed_los_hours',
+    'total_los_hours': 'total_los_hours',
+    'CHARTTIME': 'charttime',
+    'CATEGORY': 'category',
+    'DESCRIPTION': 'description',
+    'TEXT': 'text',
+}
+INT_COLUMNS = ['SUBJECT_ID', 'age_corrected']  # Nullable, HADM_ID is the primary key and never null
+FLOAT_COLUMNS = ['ed_los_hours', 'total_los_hours']
+# Table column names in PATIENT_COLUMNS order, for COPY
+COPY_COLUMNS = [Patient.__mapper__.columns[attribute].name for attribute in PATIENT_COLUMNS.values()]
+# Low-cardinality columns: read dictionary-encoded and kept as category, one string object per distinct value instead of per row
+CATEGORY_COLUMNS = ['GENDER', 'ADMISSION_TYPE', 'CATEGORY', 'DESCRIPTION']
+STRING_COLUMNS = ['DIAGNOSIS']  # TEXT is decoded straight from Arrow, see prepare_batch
+FILL_VALUES = {
+    'GENDER': 'UNKNOWN',  # Gender is stored uppercase
+    'ADMISSION_TYPE': 'Unknown', 
+    'DIAGNOSIS': 'Not specified',
+    'CATEGORY': 'Discharge summary',
+    'DESCRIPTION': 'Discharge summary',
+    'TEXT': '',
+    'HOSPITAL_EXPIRE_FLAG': False
+}
+CHARTTIME_FORMAT = '%Y-%m-%d %H:%M:%S'  # MIMIC CHARTTIME format
+
+def column_values(values: pd.Series) -> list:
+    """Column as a list of native Python values (int, float, bool, str, datetime), missing values as None"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        native = np.array(values.dt.to_pydatetime(), dtype=object)
+    else:
+        native = values.to_numpy(dtype=object, copy=True)  # numpy scalars come out as Python int/float/bool
+    native[values.isna().to_numpy()] = None
+    return native.tolist()
+
+
+def prepare_batch(batch: pa.Table) -> list:
+    """Clean a batch of parquet rows and return COPY records (tuples in COPY_COLUMNS order).
+        Plain tuples go straight to asyncpg, no Patient instances or ORM unit of work on the load path"""
+    
+    # TEXT (the bulk of the bytes) is decoded to Python strings once per batch in C and never goes through pandas
+    texts = batch.column('TEXT').cast(pa.large_string()).fill_null(FILL_VALUES['TEXT']).to_pylist()
+    batch_df = batch.drop_columns(['TEXT']).to_pandas()
+    
+    # Handle datetime columns - convert to proper datetime if they're strings
+    charttime = batch_df['CHARTTIME']
+    if not pd.api.types.is_datetime64_any_dtype(charttime):
+        # Explicit format takes the vectorized parser instead of per-row inference
+        parsed = pd.to_datetime(charttime, format=CHARTTIME_FORMAT, errors='coerce', cache=True)
+        # Values in any other format still go through inference, as before
+        unparsed = parsed.isna() & charttime.notna()
+        if unparsed.any():
+            parsed[unparsed] = pd.to_datetime(charttime[unparsed], errors='coerce')
+        batch_df['CHARTTIME'] = parsed
+    
+    # Categories must include their fill value before fillna
+    for column in CATEGORY_COLUMNS:
+        values = batch_df[column].astype('category')
+        if FILL_VALUES[column] not in values.cat.categories:
+            values = values.cat.add_categories([FILL_VALUES[column]])
+        batch_df[column] = values
+    
+    # Handle NaN values
+    batch_df = batch_df.fillna(FILL_VALUES)
+    
+    # Stored uppercase like create_patient does, the gender filter compares against upper()
+    batch_df['GENDER'] = batch_df['GENDER'].map(str.upper)
+    
+    # Convert boolean columns
+    batch_df['HOSPITAL_EXPIRE_FLAG'] = batch_df['HOSPITAL_EXPIRE_FLAG'].astype(bool)
+    
+    # Column-wise casts instead of per cell (int() truncates, so does np.trunc)
+    batch_df['HADM_ID'] = batch_df['HADM_ID'].astype('int64')
+    for column in INT_COLUMNS:
+        batch_df[column] = np.trunc(batch_df[column].astype('float64')).astype('Int64')
+    for column in FLOAT_COLUMNS:
+        batch_df[column] = batch_df[column].astype('float64')
+    for column in STRING_COLUMNS:
+        batch_df[column] = batch_df[column].astype(str)
+    
+    # Native Python values (datetime rather than pd.Timestamp, int rather than numpy.int64) for asyncpg's binary COPY encoders
+    columns = [texts if column == 'TEXT' else column_values(batch_df[column]) for column in PATIENT_COLUMNS]
+    return list(zip(*columns))
+
+
+def batch_to_records(ipc_bytes: bytes) -> list:
+    """Worker process entry point: Arrow IPC stream holding one record batch -> COPY records"""
+    return prepare_batch(pa.ipc.open_stream(ipc_bytes).read_all())
+
+
+def iter_ipc_batches(dataset: ds.Dataset, keep_mask: np.ndarray, batch_size: int):
+    """Yield (ipc_bytes, rows_read) for every scanned batch with rows left to insert (blocking, meant for a worker thread)"""
+    row_offset = 0
+
+    # Ordered scan (batches come back in file order, which keep_mask relies on)
+    scanner = dataset.scanner(columns=list(PATIENT_COLUMNS), batch_size=batch_size)
+    for batch in scanner.to_batches():
+        batch_keep = keep_mask[row_offset:row_offset + batch.num_rows]
+        row_offset += batch.num_rows
+
+        # Drop duplicates while still in Arrow, only the kept rows are shipped to the worker processes
+        batch = batch.filter(pa.array(batch_keep))
+        if not batch.num_rows:
+            continue
+
+        # IPC bytes are picklable and cheap to rebuild on the other side
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, batch.schema) as writer:
+            writer.write_batch(batch)
+        yield sink.getvalue().to_pybytes(), row_offset
+
+
+async def drop_load_indexes(conn) -> list[str]:
+    """Drop the patients primary key, the foreign keys referencing it and its secondary indexes.
+        Returns the statements that recreate them, in order (primary key, indexes, foreign keys)"""
+    table = Patient.__tablename__
+    
+    constraints = (await conn.execute(text(
+        "SELECT conrelid::regclass::text AS table_name, quote_ident(conname) AS name, "
+        "pg_get_constraintdef(oid) AS definition, contype::text AS contype "
+        "FROM pg_constraint "
+        "WHERE (conrelid = CAST(:table AS regclass) AND contype = 'p') "
+        "OR (confrelid = CAST(:table AS regclass) AND contype = 'f')"
+    ), {"table": table})).all()
+    foreign_keys = [constraint for constraint in constraints if constraint.contype == 'f']
+    primary_keys = [constraint for constraint in constraints if constraint.contype == 'p']
+    # Indexes not backing a constraint (the primary key one goes with its constraint)
+    indexes = (await conn.execute(text(
+        "SELECT indexrelid::regclass::text AS name, pg_get_indexdef(indexrelid) AS definition "
+        "FROM pg_index "
+        "WHERE indrelid = CAST(:table AS regclass) "
+        "AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid AND conrelid = indrelid)"
+    ), {"table": table})).all()
+    
+    # Foreign keys first, they depend on the primary key
+    for constraint in foreign_keys + primary_keys:
+        await conn.exec_driver_sql(f"ALTER TABLE {constraint.table_name} DROP CONSTRAINT {constraint.name}")
+    for index in indexes:
+        await conn.exec_driver_sql(f"DROP INDEX {index.name}")
+    logger.info("Dropped keys and indexes for the load", constraints=len(constraints), indexes=len(indexes))
+    
+    return (
+        [f"ALTER TABLE {c.table_name} ADD CONSTRAINT {c.name} {c.definition}" for c in primary_keys]
+        + [index.definition for index in indexes]
+        + [f"ALTER TABLE {c.table_name} ADD CONSTRAINT {c.name} {c.definition}" for c in foreign_keys]
+    )
+
+
+async def load_parquet_data(parquet_file_path: str, batch_size: int = 10_000):
+    """Load MIMIC data from parquet file into PostgreSQL.
+        The file (or directory of files) is streamed in Arrow record batches, so memory stays O(batch) instead of O(file)"""
     
     try:
-        # Read parquet file
+        # Open parquet dataset (only metadata is read here)
         logger.info("Reading parquet file", path=parquet_file_path)
-        df = pd.read_parquet(parquet_file_path)
-        logger.info("Original data", total_rows=len(df), unique_admissions=df['HADM_ID'].nunique())
-        df_deduplicated = df.drop_duplicates(subset=['HADM_ID'], keep='last') # handle HADM_ID duplicate entries
-        
-        # Log basic info
-        logger.info("Parquet file loaded", 
-                   rows=len(df_deduplicated), 
-                   columns=list(df_deduplicated.columns),
-                   memory_usage_mb=df_deduplicated.memory_usage(deep=True).sum() / 1024**2)
+        dataset = ds.dataset(parquet_file_path, format=ds.ParquetFileFormat(dictionary_columns=CATEGORY_COLUMNS))
         
-        # Handle datetime columns - convert to proper datetime if they're strings
-        if 'CHARTTIME' in df_deduplicated.columns:
-            df_deduplicated['CHARTTIME'] = pd.to_datetime(df_deduplicated['CHARTTIME'], errors='coerce')
+        # Handle HADM_ID duplicate entries (keep last): decided up front from the HADM_ID column alone,
+        # projection pushdown means the other column chunks (TEXT above all) are not read for this pass
+        hadm_ids = dataset.to_table(columns=['HADM_ID']).column('HADM_ID').to_pandas()
+        logger.info("Original data", total_rows=len(hadm_ids), unique_admissions=hadm_ids.nunique())
+        keep_mask = ~hadm_ids.duplicated(keep='last').to_numpy()
         
-        # Handle NaN values
-        df_deduplicated = df_deduplicated.fillna({
-            'GENDER': 'Unknown',
-            'ADMISSION_TYPE': 'Unknown', 
-            'DIAGNOSIS': 'Not specified',
-            'CATEGORY': 'Discharge summary',
-            'DESCRIPTION': 'Discharge summary',
-            'TEXT': '',
-            'HOSPITAL_EXPIRE_FLAG': False
-        })
+        # Rows without HADM_ID can't be inserted (primary key)
+        missing_hadm_id = hadm_ids.isna().to_numpy()
+        if missing_hadm_id.any():
+            logger.warning("Skipping rows without HADM_ID", rows=int(missing_hadm_id.sum()))
+            keep_mask &= ~missing_hadm_id
         
-        # Convert boolean columns
-        if 'HOSPITAL_EXPIRE_FLAG' in df_deduplicated.columns:
-            df_deduplicated['HOSPITAL_EXPIRE_FLAG'] = df_deduplicated['HOSPITAL_EXPIRE_FLAG'].astype(bool)
-        
-        total_rows = len(df_deduplicated)
+        total_rows = int(keep_mask.sum())
         logger.info("Starting data insertion", total_rows=total_rows, batch_size=batch_size)
         
-        # Process in batches for memory efficiency
+        # Pipeline: the producer scans in a worker thread and hands batches to a process pool for conversion,
+        # the consumer COPYs them as they complete. The bounded queue applies backpressure,
+        # at most maxsize batches are in flight (enough to keep every worker busy)
+        workers = max(1, (os.cpu_count() or 2) // 2)
+        queue = asyncio.Queue(maxsize=workers + 2)
         inserted_count = 0
-        
-        async with AsyncSessionLocal() as session:
-            for start_idx in range(0, total_rows, batch_size):
-                end_idx = min(start_idx + batch_size, total_rows)
-                batch_df = df_deduplicated.iloc[start_idx:end_idx]
-                
-                # Create Patient objects for this batch
-                patients = []
-                for _, row in batch_df.iterrows():
-                    # Map column names (handle case differences)
-                    patient = Patient(
-                        subject_id=int(row['SUBJECT_ID']) if pd.notna(row['SUBJECT_ID']) else None,
-                        gender=str(row['GENDER']) if pd.notna(row['GENDER']) else 'Unknown',
-                        hadm_id=int(row['HADM_ID']) if pd.notna(row['HADM_ID']) else None,
-                        admission_type=str(row['ADMISSION_TYPE']) if pd.notna(row['ADMISSION_TYPE']) else 'Unknown',
-                        diagnosis=str(row['DIAGNOSIS']) if pd.notna(row['DIAGNOSIS']) else 'Not specified',
-                        hospital_expire_flag=bool(row['HOSPITAL_EXPIRE_FLAG']) if pd.notna(row['HOSPITAL_EXPIRE_FLAG']) else False,
-                        age_corrected=int(row['age_corrected']) if pd.notna(row['age_corrected']) else None,
-                        ed_los_hours=float(row['ed_los_hours']) if pd.notna(row['ed_los_hours']) else None,
-                        total_los_hours=float(row['total_los_hours']) if pd.notna(row['total_los_hours']) else None,
-                        charttime=row['CHARTTIME'] if pd.notna(row['CHARTTIME']) else None,
-                        category=str(row['CATEGORY']) if pd.notna(row['CATEGORY']) else 'Discharge summary',
-                        description=str(row['DESCRIPTION']) if pd.notna(row['DESCRIPTION']) else 'Discharge summary',
-                        text=str(row['TEXT']) if pd.notna(row['TEXT']) else ''
-                    )
-                    patients.append(patient)
-                
-                # Add batch to session
-                session.add_all(patients)
-                
-                # Commit every batch
-                await session.commit()
-                
-                inserted_count += len(patients)
-                logger.info("Batch inserted", 
-                           batch=f"{start_idx+1}-{end_idx}", 
-                           inserted=inserted_count, 
+
+        async def produce(executor):
+            loop = asyncio.get_running_loop()
+            ipc_batches = iter_ipc_batches(dataset, keep_mask, batch_size)
+            while (item := await asyncio.to_thread(next, ipc_batches, None)) is not None:
+                ipc_bytes, rows_read = item
+                # Futures are queued in scan order, so batches are COPYed in file order whichever worker finishes first
+                await queue.put((loop.run_in_executor(executor, batch_to_records, ipc_bytes), rows_read))
+            await queue.put(None)  # Scan finished
+
+        async def consume(asyncpg_connection):
+            nonlocal inserted_count
+            while (item := await queue.get()) is not None:
+                records_future, rows_read = item
+                records = await records_future
+                await asyncpg_connection.copy_records_to_table(
+                    Patient.__tablename__,
+                    records=records,
+                    columns=COPY_COLUMNS
+                )
+
+                inserted_count += len(records)
+                logger.info("Batch inserted",
+                           rows_read=rows_read,
+                           inserted=inserted_count,
                            total=total_rows,
                            progress_pct=round(100 * inserted_count / total_rows, 1))
+
+        # One transaction for the whole load: a single WAL flush at commit instead of one per COPY.
+        # synchronous_commit is relaxed for this transaction only (SET LOCAL), a crash loses the load, not consistency
+        async with bulk_engine.begin() as conn:
+            await conn.execute(text("SET LOCAL synchronous_commit = off"))
+            raw_connection = await conn.get_raw_connection()
+            asyncpg_connection = raw_connection.driver_connection
+            
+            # Build keys and indexes once after the load instead of maintaining them on every row.
+            # DDL is transactional in PostgreSQL: if the load fails, the rollback puts them back
+            restore_statements = await drop_load_indexes(conn)
+
+            # TaskGroup rather than gather: if one side fails the other is cancelled instead of blocking on the queue
+            # forkserver: forking this process, which already runs the to_thread and Arrow thread pools, can deadlock
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("forkserver"))
+            try:
+                async with asyncio.TaskGroup() as task_group:
+                    task_group.create_task(produce(executor))
+                    task_group.create_task(consume(asyncpg_connection))
+            except ExceptionGroup as group:
+                raise group.exceptions[0]  # Original error, the whole load is rolled back
+            finally:
+                # Nothing is pending after a successful load; after a failure, queued conversions are cancelled
+                # instead of blocking the event loop until they finish
+                executor.shutdown(wait=False, cancel_futures=True)
+            
+            logger.info("Rebuilding keys and indexes", statements=len(restore_statements))
+            for statement in restore_statements:
+                await conn.exec_driver_sql(statement)
         
         logger.info("Data loading completed successfully", 
                    total_inserted=inserted_count,
@@ -99,38 +274,34 @@ async def load_parquet_data(parquet_file_path: str, batch_size: int = 1000):
         logger.error("Data loading failed", error=str(e))
         raise
 
-async def check_data_count():
+async def check_data_count(conn: AsyncConnection):
     """Check how many records are in the database"""
-    from sqlalchemy import text
     
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(text("SELECT COUNT(*) FROM mimic_discharge_summaries"))
-        count = result.scalar()
-        logger.info("Database record count", count=count)
-        return count
+    result = await conn.execute(text("SELECT COUNT(*) FROM mimic_discharge_summaries"))
+    count = result.scalar()
+    logger.info("Database record count", count=count)
+    return count
 
-async def show_sample_data(limit: int = 5):
+async def show_sample_data(conn: AsyncConnection, limit: int = 5):
     """Show sample data from the database"""
     
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(
-            text('SELECT "SUBJECT_ID", "HADM_ID", "GENDER", "AGE_CORRECTED", "ADMISSION_TYPE", LENGTH("TEXT") as text_length FROM mimic_discharge_summaries LIMIT :limit'),
-            {"limit": limit}
-        )
-        rows = result.fetchall()
-        
-        logger.info("Sample data from database")
-        for row in rows:
-            print(f"Subject: {row[0]}, HADM: {row[1]}, Gender: {row[2]}, Age: {row[3]}, Type: {row[4]}, Text Length: {row[5]}")
+    result = await conn.execute(
+        text('SELECT "SUBJECT_ID", "HADM_ID", "GENDER", "AGE_CORRECTED", "ADMISSION_TYPE", LENGTH("TEXT") as text_length FROM mimic_discharge_summaries LIMIT :limit'),
+        {"limit": limit}
+    )
+    rows = result.fetchall()
+    
+    logger.info("Sample data from database")
+    for row in rows:
+        print(f"Subject: {row[0]}, HADM: {row[1]}, Gender: {row[2]}, Age: {row[3]}, Type: {row[4]}, Text Length: {row[5]}")
 
-async def clear_table():
-    async with AsyncSessionLocal() as session:
-        # Delete AI summaries
-        await session.execute(text('DELETE FROM ai_summaries'))
-        # Delete patients  
-        await session.execute(text('DELETE FROM mimic_discharge_summaries'))
-        await session.commit()
-        print('Tables cleared')
+async def clear_table(conn: AsyncConnection):
+    # Delete AI summaries
+    await conn.execute(text('DELETE FROM ai_summaries'))
+    # Delete patients  
+    await conn.execute(text('DELETE FROM mimic_discharge_summaries'))
+    await conn.commit()
+    print('Tables cleared')
 
 
 
@@ -138,14 +309,18 @@ async def load_pipeline(parquet_path: str):
         
        
 
-        await clear_table()
-        
-        # Load the data
-        count = await load_parquet_data(parquet_path)
-        
-        # Verify the data
-        await check_data_count() 
-        await show_sample_data()
+        # One connection for the helper queries instead of one per call. A connection (unlike a session)
+        # stays checked out across commit, which matters with NullPool: release means close.
+        # The load itself runs in its own transaction on a second connection
+        async with bulk_engine.connect() as conn:
+            await clear_table(conn)
+            
+            # Load the data
+            count = await load_parquet_data(parquet_path)
+            
+            # Verify the data
+            await check_data_count(conn) 
+            await show_sample_data(conn)
         
         print(f"\n Successfully loaded {count} discharge summaries!")
 
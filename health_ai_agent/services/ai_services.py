@@ -1,26 +1,57 @@
 from huggingface_hub import InferenceClient
+from huggingface_hub.utils import get_session
 from ..config import settings
+import structlog
+
+logger = structlog.get_logger()
+
+# Hosts the first inference call goes through (provider lookup on the Hub, then the inference router)
+WARM_UP_URLS = ("https://huggingface.co", "https://router.huggingface.co")
+WARM_UP_TIMEOUT = 5.0
 
 class AIService:
     def __init__(self):
         self.client = None
     
     async def initialize(self):
-        """Initialize AI client via Hugging Face API"""
+        """Initialize AI client via Hugging Face API.
+            Called once from the app lifespan, every request reuses this client. HTTP connections are pooled
+            per thread by huggingface_hub, not shared by the whole process"""
+
+        if self.client is not None:
+            return True
+
+        if not settings.hf_token:
+            logger.warning("HF_TOKEN not set, AI client not initialized")
+            return False
 
-        if settings.hf_token:
+        try:
+            self.client = InferenceClient(
+                model="m42-health/Llama3-Med42-8B",
+                token=settings.hf_token,
+                timeout=settings.ai_timeout,
+                headers={"Accept-Encoding": "identity"}
+            )
+        
+        except Exception as e:
+            logger.error("Failed to initialize AI client", error=str(e))
+            return False
+
+        # Called on the event-loop thread on purpose: see _warm_up
+        self._warm_up()
+        return True
+    
+    def _warm_up(self):
+        """HEAD request to each inference host so the first /summarize call doesn't pay DNS + TLS handshake.
+            huggingface_hub keeps one HTTP session per thread, this only warms the calling thread's pool: the event-loop
+            thread, where /summarize calls the client. Streams run in threadpool threads with their own sessions.
+            Best effort (short timeout, once at startup), the client works without it"""
+        session = get_session()
+        for url in WARM_UP_URLS:
             try:
-                self.client = InferenceClient(
-                    model="m42-health/Llama3-Med42-8B",
-                    token=settings.hf_token,
-                    headers={"Accept-Encoding": "identity"}
-                )
-                return True
-            
+                session.head(url, timeout=WARM_UP_TIMEOUT)
             except Exception as e:
-                print(f"Failed to initialize AI client: {e}")
-                return False
-        
+                logger.warning("AI client warm-up failed", url=url, error=str(e))
     
     def get_client(self) -> InferenceClient:
         """Get the AI client with error handling"""
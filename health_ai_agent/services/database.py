@@ -1,7 +1,8 @@
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy import Column, Integer, String, Text, Float, Boolean, DateTime, text, ForeignKey
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy import Column, Integer, String, Text, Float, Boolean, DateTime, text, ForeignKey, Index, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from typing import AsyncGenerator
 import structlog
 from datetime import datetime
@@ -13,9 +14,12 @@ logger = structlog.get_logger()
 # Async engine
 engine = create_async_engine(
     settings.database_url,
-    echo=settings.debug,  # Log SQL queries in debug mode
+    echo=settings.db_echo,  # Log SQL queries (kept separate from debug, it is slow under load)
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
+    pool_timeout=settings.db_pool_timeout,
     pool_pre_ping=True,   # Verify connections before use
-    pool_recycle=3600,    # Recycle connections every hour
+    pool_recycle=settings.db_pool_recycle,    # Recycle connections every 30 minutes
 )
 
 # Session factory
@@ -45,19 +49,44 @@ class Patient(Base):
     category = Column(String, name="CATEGORY")
     description = Column(String, name="DESCRIPTION")
     text = Column(Text, name="TEXT")
+    # Full-text search document for /patients/list (generated by PostgreSQL, only used in WHERE so never loaded)
+    search_tsv = deferred(Column(
+        TSVECTOR,
+        Computed(
+            """to_tsvector('english', coalesce("DIAGNOSIS", '') || ' ' || coalesce("ADMISSION_TYPE", '') || ' ' || coalesce("GENDER", ''))""",
+            persisted=True
+        ),
+        name="SEARCH_TSV"
+    ))
+
+    # Summaries are removed by the database (ON DELETE CASCADE), not loaded and deleted by the ORM
+    summaries = relationship("AISummary", back_populates="patient", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        # Equality/range filters used by /patients/list
+        Index("ix_patient_filters", "GENDER", "ADMISSION_TYPE", "AGE_CORRECTED"),
+        # Trigram index so ILIKE '%q%' on the diagnosis can use an index (requires pg_trgm)
+        Index("ix_patient_diag_trgm", "DIAGNOSIS", postgresql_using="gin", postgresql_ops={"DIAGNOSIS": "gin_trgm_ops"}),
+        Index("ix_patient_tsv", "SEARCH_TSV", postgresql_using="gin"),
+    )
 
 class AISummary(Base):
     __tablename__ = "ai_summaries"
     
     id = Column(Integer, primary_key=True, index=True)
-    hadm_id = Column(Integer, ForeignKey("mimic_discharge_summaries.HADM_ID"), nullable=False, index=True)
+    hadm_id = Column(Integer, ForeignKey("mimic_discharge_summaries.HADM_ID", ondelete="CASCADE"), nullable=False, index=True)
     summary_text = Column(Text, nullable=False)
     original_length = Column(Integer, nullable=False)
     processing_time = Column(Float, nullable=False)
     model_used = Column(String(100), default="m42-health/Llama3-Med42-8B")
     created_at = Column(DateTime, default=datetime.utcnow)
+    prompt_hash = Column(String(32), index=True)  # blake2b of the prompt, used as a summary cache key
     
-    patient = relationship("Patient", foreign_keys=[hadm_id])
+    patient = relationship("Patient", foreign_keys=[hadm_id], back_populates="summaries")
+
+
+# Ordering for /ai/summaries (most recent first)
+Index("ix_aisummary_created", AISummary.created_at.desc())
 
 
 # Dependency to get database session